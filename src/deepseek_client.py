@@ -1,15 +1,20 @@
 import os
 import yaml
-from openai import OpenAI
 from pathlib import Path
 from dotenv import load_dotenv
+from endpoint_pool import EndpointPool
+from telemetry import Telemetry
+
+def section_concurrency(config):
+    """章节并发生成数，未配置时与 ThreadPoolExecutor 的默认值一致"""
+    return config["generation"].get("concurrency") or min(32, (os.cpu_count() or 1) + 4)
 
 class DeepSeekClient:
     def __init__(self, config_path="config/config.yaml"):
         self.config = self._load_config(config_path)
-        self.client = OpenAI(
-            api_key=self.config["api"]["api_key"],
-            base_url=self.config["api"]["base_url"]
+        self.telemetry = Telemetry(self.config["paths"].get("telemetry_file"))
+        self.pool = EndpointPool(
+            self.config["api"], self.config.get("stages"), self.telemetry, section_concurrency(self.config)
         )
         
     def _load_config(self, config_path):
@@ -41,8 +46,8 @@ class DeepSeekClient:
         
         try:
             # 分析招标文件要求
-            analysis_response = self.client.chat.completions.create(
-                model=self.config["api"]["model"],
+            analysis_response = self.pool.chat(
+                stage="analysis",
                 messages=[
                     {"role": "system", "content": "你是一个专业的标书分析专家，擅长提取招标文件中的关键要求。"},
                     {"role": "user", "content": analysis_prompt}
@@ -71,8 +76,8 @@ class DeepSeekClient:
 请生成完整的章节内容。
 """
             
-            response = self.client.chat.completions.create(
-                model=self.config["api"]["model"],
+            response = self.pool.chat(
+                stage="generation",
                 messages=[
                     {"role": "system", "content": "你是一个专业的标书撰写专家，擅长根据招标文件生成高质量的标书内容。"},
                     {"role": "user", "content": generation_prompt}
@@ -100,8 +105,8 @@ class DeepSeekClient:
 如果发现问题，请指出具体问题并提供改进建议。
 """
             
-            check_response = self.client.chat.completions.create(
-                model=self.config["api"]["model"],
+            check_response = self.pool.chat(
+                stage="check",
                 messages=[
                     {"role": "system", "content": "你是一个专业的标书质量检查专家。"},
                     {"role": "user", "content": check_prompt}
@@ -126,8 +131,8 @@ class DeepSeekClient:
 请根据检查结果优化内容，确保符合所有要求。
 """
                 
-                optimization_response = self.client.chat.completions.create(
-                    model=self.config["api"]["model"],
+                optimization_response = self.pool.chat(
+                    stage="optimization",
                     messages=[
                         {"role": "system", "content": "你是一个专业的标书优化专家。"},
                         {"role": "user", "content": optimization_prompt}
@@ -147,8 +152,8 @@ class DeepSeekClient:
 
     def generate_content(self, prompt, max_tokens=2000):
         try:
-            response = self.client.chat.completions.create(
-                model=self.config["api"]["model"],
+            response = self.pool.chat(
+                stage="content",
                 messages=[
                     {"role": "system", "content": "你是一个专业的标书撰写专家，擅长根据招标文件生成高质量的投标文件。"},
                     {"role": "user", "content": prompt}
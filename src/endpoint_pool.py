@@ -0,0 +1,421 @@
+import logging
+import os
+import random
+import threading
+import time
+import concurrent.futures
+from collections import defaultdict, deque
+from types import SimpleNamespace
+import openai
+from openai import OpenAI
+from telemetry import percentile
+
+
+class StreamInterrupted(Exception):
+    """流式响应读取过程中连接中断"""
+
+
+# 只有网络错误、超时、限流和服务端错误计入端点健康状态并触发切换，其余错误（如 400/401）直接抛出
+RETRYABLE_ERRORS = (
+    openai.APIConnectionError,  # 包含 APITimeoutError
+    openai.RateLimitError,
+    openai.InternalServerError,
+    StreamInterrupted,
+)
+
+
+# 调用阶段名称，stages 路由配置的键
+STAGES = [
+    "extract_requirements", "extract_industry", "extract_sections",
+    "analysis", "generation", "check", "optimization", "content",
+]
+# stages 路由配置中允许的字段
+ROUTE_FIELDS = {"model", "endpoints", "max_tokens", "temperature", "top_p", "timeout"}
+
+# 历史样本不足时各阶段的对冲等待时间（秒）
+DEFAULT_INITIAL_DELAYS = {
+    "extract_requirements": 30,
+    "extract_industry": 40,
+    "extract_sections": 20,
+    "analysis": 30,
+    "generation": 90,
+    "check": 30,
+    "optimization": 90,
+    "content": 60,
+}
+
+
+def endpoint_configs(api_config):
+    """规范化端点配置，未配置 endpoints 时由 base_url / api_key / model 生成单个端点"""
+    configs = api_config.get("endpoints") or [{
+        "base_url": api_config["base_url"],
+        "api_key": api_config["api_key"],
+        "model": api_config["model"],
+    }]
+    return [
+        {
+            **ep,
+            "name": ep.get("name", ep["base_url"]),
+            "api_key": ep.get("api_key", api_config.get("api_key")),
+            "model": ep.get("model", api_config.get("model")),
+            "weight": float(ep.get("weight", 1)),
+        }
+        for ep in configs
+    ]
+
+
+def stage_route(stages_config, stage):
+    """返回阶段路由配置：(可用端点名集合, 覆盖的模型, 覆盖的调用参数)"""
+    route = dict((stages_config or {}).get(stage) or {})
+    allowed = route.pop("endpoints", None)
+    model = route.pop("model", None)
+    return (set(allowed) if allowed else None), model, route
+
+
+def eligible_endpoints(endpoints, allowed):
+    """阶段可使用的端点：限定了 endpoints 时取其中的端点，否则取权重大于 0 的端点"""
+    if allowed is None:
+        # 权重为 0 的端点只在阶段路由中显式指定时使用
+        return [ep for ep in endpoints if ep.weight > 0] or list(endpoints)
+    return [ep for ep in endpoints if ep.name in allowed]
+
+
+def stage_model_shares(endpoints, stages_config, stage):
+    """
+    阶段路由后各模型承担的请求比例
+
+    Args:
+        endpoints (list): 具有 name、model、weight 属性的端点
+        stages_config (dict): stages 路由配置
+        stage (str): 阶段名称
+
+    Returns:
+        dict: 模型名称 -> 请求比例
+    """
+    allowed, model, _ = stage_route(stages_config, stage)
+    if model:
+        return {model: 1.0}
+    candidates = eligible_endpoints(endpoints, allowed)
+    total = sum(ep.weight for ep in candidates)
+    shares = {}
+    for ep in candidates:
+        share = ep.weight / total if total > 0 else 1 / len(candidates)
+        shares[ep.model] = shares.get(ep.model, 0.0) + share
+    return shares
+
+
+class Endpoint:
+    """单个 API 端点及其健康状态"""
+
+    def __init__(self, name, base_url, api_key, model, weight=1.0, timeout=None, max_retries=2, stream_usage=True):
+        self.name = name
+        self.base_url = base_url
+        self.model = model
+        self.weight = float(weight)
+        # 流式响应末尾返回 token 用量，端点不支持 stream_options 时可关闭
+        self.stream_usage = stream_usage
+        self.client = OpenAI(api_key=api_key, base_url=base_url, timeout=timeout, max_retries=max_retries)
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+
+    def is_healthy(self, now=None):
+        return (now or time.monotonic()) >= self.open_until
+
+
+class Attempt:
+    """一次发往某个端点的请求，可在其他请求胜出后关闭其流式连接以中止"""
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.cancelled = False
+        self._stream = None
+        self._lock = threading.Lock()
+
+    def attach(self, stream):
+        """登记流式连接，已被取消时返回 False"""
+        with self._lock:
+            self._stream = stream
+            return not self.cancelled
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            stream = self._stream
+        if stream is not None:
+            try:
+                stream.close()
+            except Exception:
+                pass
+
+
+class EndpointPool:
+    """
+    多端点调用池：按权重选择健康端点，超过历史分位延迟后向另一端点发送对冲请求，
+    先返回者胜出，较慢的请求被中止；网络、限流或服务端错误时自动切换到其他端点。
+    """
+
+    def __init__(self, api_config, stages_config=None, telemetry=None, concurrency=None):
+        self.timeout = api_config.get("timeout", 180)
+        configs = endpoint_configs(api_config)
+        # 单端点时保留 SDK 对 429/5xx 的退避重试；多端点时失败直接切换到其他端点
+        max_retries = api_config.get("max_retries", 2 if len(configs) == 1 else 0)
+        self.retry_backoff = api_config.get("retry_backoff", 1.0)
+        self.endpoints = [
+            Endpoint(
+                name=ep["name"],
+                base_url=ep["base_url"],
+                api_key=ep["api_key"],
+                model=ep["model"],
+                weight=ep["weight"],
+                timeout=ep.get("timeout", self.timeout),
+                max_retries=max_retries,
+                stream_usage=ep.get("stream_usage", True),
+            )
+            for ep in configs
+        ]
+
+        health = api_config.get("health", {})
+        self.failure_threshold = health.get("failure_threshold", 3)
+        self.cooldown = health.get("cooldown", 30)
+
+        hedge = api_config.get("hedge", {})
+        self.hedge_enabled = hedge.get("enabled", True)
+        self.hedge_percentile = hedge.get("percentile", 0.9)
+        self.hedge_min_delay = hedge.get("min_delay", 2.0)
+        # 可为各阶段分别配置，也可配置为统一的数值；为 null 时样本不足则不对冲
+        self.hedge_initial_delay = hedge.get("initial_delay", {})
+        if isinstance(self.hedge_initial_delay, dict):
+            self.hedge_initial_delay = {**DEFAULT_INITIAL_DELAYS, **self.hedge_initial_delay}
+        self.hedge_min_samples = hedge.get("min_samples", 5)
+        self.max_attempts = hedge.get("max_attempts", len(self.endpoints) + 1)
+
+        # 分阶段路由：可为每个阶段指定模型、可用端点及 max_tokens 等调用参数
+        self.stages = stages_config or {}
+        self.telemetry = telemetry
+        self._validate_stages()
+
+        self._latencies = defaultdict(lambda: deque(maxlen=hedge.get("window", 200)))
+        self._lock = threading.Lock()
+        self._active = set()
+        self._seed_latencies()
+
+        # 对冲期间主请求和对冲请求同时占用线程，因此至少为每个并发章节预留两个线程
+        concurrency = concurrency or min(32, (os.cpu_count() or 1) + 4)
+        max_workers = api_config.get("max_workers") or 2 * concurrency
+        if max_workers < 2 * concurrency:
+            logging.warning(f"api.max_workers={max_workers} 小于章节并发数的两倍（{2 * concurrency}），对冲请求可能排队")
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix="endpoint-pool",
+        )
+
+    def pick(self, exclude=(), allowed=None, reuse=True):
+        """
+        按权重从健康端点中选择一个，全部熔断时退回熔断中的端点
+
+        reuse 为 False 时（对冲请求）只在 exclude 之外选择，没有可用端点时返回 None
+        """
+        now = time.monotonic()
+        pool = eligible_endpoints(self.endpoints, allowed)
+        with self._lock:
+            candidates = [ep for ep in pool if ep not in exclude and ep.is_healthy(now)]
+            if not candidates:
+                candidates = [ep for ep in pool if ep not in exclude]
+            if not candidates and reuse:
+                candidates = list(pool)
+        if not candidates:
+            return None
+        return random.choices(candidates, weights=[max(ep.weight, 0.001) for ep in candidates])[0]
+
+    def _validate_stages(self):
+        """检查阶段路由配置：字段和端点名称必须有效，指定模型时应同时限定端点"""
+        names = {ep.name for ep in self.endpoints}
+        for stage, route in self.stages.items():
+            route = route or {}
+            if stage not in STAGES:
+                logging.warning(f"stages.{stage} 不是已知的阶段，该配置不会生效，可用阶段: {', '.join(STAGES)}")
+            invalid = set(route) - ROUTE_FIELDS
+            if invalid:
+                raise ValueError(f"stages.{stage} 中包含不支持的字段: {', '.join(sorted(invalid))}，可用字段: {', '.join(sorted(ROUTE_FIELDS))}")
+            unknown = set(route.get("endpoints") or []) - names
+            if unknown:
+                raise ValueError(f"stages.{stage}.endpoints 中包含未定义的端点: {', '.join(sorted(unknown))}，可用端点: {', '.join(sorted(names))}")
+            if route.get("model") and not route.get("endpoints"):
+                logging.warning(f"stages.{stage} 指定了模型 {route['model']} 但未限定 endpoints，请求会发往所有端点，请确认它们都提供该模型")
+
+    def stage_models(self, stage):
+        """阶段路由后可能使用的模型集合"""
+        return set(stage_model_shares(self.endpoints, self.stages, stage))
+
+    def _seed_latencies(self):
+        """用历史调用记录中同阶段、同模型的延迟初始化样本，使首批请求即可按分位数对冲"""
+        if not self.telemetry:
+            return
+        models = {}
+        for record in self.telemetry.load_history():
+            stage = record.get("stage")
+            if stage not in models:
+                models[stage] = self.stage_models(stage)
+            # 只使用单次请求耗时，与运行中记录的样本口径一致；端到端耗时包含对冲等待和退避
+            if record.get("model") in models[stage] and record.get("attempt_latency") is not None:
+                self._latencies[stage].append(record["attempt_latency"])
+
+    def hedge_delay(self, stage):
+        """返回该阶段的对冲等待时间，历史样本不足时返回初始值（可能为 None，即不对冲）"""
+        if not self.hedge_enabled:
+            return None
+        with self._lock:
+            samples = list(self._latencies[stage])
+        if len(samples) < self.hedge_min_samples:
+            if isinstance(self.hedge_initial_delay, dict):
+                return self.hedge_initial_delay.get(stage)
+            return self.hedge_initial_delay
+        return max(self.hedge_min_delay, percentile(samples, self.hedge_percentile))
+
+    def _record_success(self, endpoint, stage, latency):
+        with self._lock:
+            endpoint.consecutive_failures = 0
+            endpoint.open_until = 0.0
+            self._latencies[stage].append(latency)
+
+    def _record_failure(self, endpoint):
+        with self._lock:
+            endpoint.consecutive_failures += 1
+            if endpoint.consecutive_failures >= self.failure_threshold:
+                endpoint.open_until = time.monotonic() + self.cooldown
+                logging.warning(f"端点 {endpoint.name} 连续失败 {endpoint.consecutive_failures} 次，暂停使用 {self.cooldown} 秒")
+
+    def route(self, stage):
+        """返回阶段路由配置：(可用端点名集合, 覆盖的模型, 覆盖的调用参数)"""
+        return stage_route(self.stages, stage)
+
+    def _invoke(self, attempt, model, messages, params):
+        """以流式方式发送请求并拼接结果，被取消时关闭连接并抛出 CancelledError"""
+        endpoint = attempt.endpoint
+        if attempt.cancelled:
+            raise concurrent.futures.CancelledError()
+        start = time.monotonic()
+        if endpoint.stream_usage:
+            params = {**params, "stream_options": {"include_usage": True}}
+        stream = endpoint.client.chat.completions.create(
+            model=model or endpoint.model, messages=messages, stream=True, **params
+        )
+        if not attempt.attach(stream):
+            stream.close()
+            raise concurrent.futures.CancelledError()
+        parts = []
+        usage = None
+        finish_reason = None
+        try:
+            for chunk in stream:
+                if getattr(chunk, "usage", None):
+                    usage = chunk.usage
+                if chunk.choices:
+                    choice = chunk.choices[0]
+                    if choice.delta and choice.delta.content:
+                        parts.append(choice.delta.content)
+                    finish_reason = choice.finish_reason or finish_reason
+        except Exception as e:
+            if attempt.cancelled:
+                raise concurrent.futures.CancelledError()
+            if isinstance(e, openai.APIError):
+                raise
+            raise StreamInterrupted(str(e)) from e
+        if attempt.cancelled:
+            raise concurrent.futures.CancelledError()
+        # 与 ChatCompletion 中调用方用到的字段保持一致
+        response = SimpleNamespace(
+            model=model or endpoint.model,
+            choices=[SimpleNamespace(
+                message=SimpleNamespace(role="assistant", content="".join(parts)),
+                finish_reason=finish_reason,
+            )],
+            usage=usage,
+        )
+        return response, time.monotonic() - start
+
+    def close(self):
+        """中止所有进行中的请求并关闭线程池，避免退出时等待被放弃的请求"""
+        with self._lock:
+            active = list(self._active)
+        for attempt in active:
+            attempt.cancel()
+        self._executor.shutdown(wait=False)
+
+    def chat(self, messages, stage="default", **params):
+        """
+        发送对话请求，返回首个成功的响应
+
+        Args:
+            messages (list): 对话消息
+            stage (str): 调用阶段名称，用于按阶段统计延迟并计算对冲时间
+            **params: 传给 chat.completions.create 的其余参数，可被阶段路由配置覆盖
+
+        Returns:
+            SimpleNamespace: 拼接后的模型响应，包含 choices[0].message.content 和 usage
+        """
+        allowed, model, overrides = self.route(stage)
+        params = {**params, **overrides}
+        attempts = {}
+        launched = []
+        tried = []
+        last_error = None
+        start = time.monotonic()
+
+        def launch(exclude, reuse=True):
+            endpoint = self.pick(exclude=exclude, allowed=allowed, reuse=reuse)
+            if endpoint is None:
+                return None
+            tried.append(endpoint)
+            attempt = Attempt(endpoint)
+            launched.append(attempt)
+            with self._lock:
+                self._active.add(attempt)
+            attempts[self._executor.submit(self._invoke, attempt, model, messages, params)] = attempt
+            return endpoint
+
+        launch(())
+        hedge_delay = self.hedge_delay(stage)
+        hedged = False
+        try:
+            while attempts:
+                timeout = hedge_delay if not hedged and len(tried) < self.max_attempts else None
+                done, _ = concurrent.futures.wait(
+                    attempts, timeout=timeout, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                if not done:
+                    # 超过分位延迟仍未返回，向另一个未尝试过的端点发送对冲请求；没有其他端点时不对冲
+                    hedged = True
+                    endpoint = launch(tried, reuse=False)
+                    if endpoint is not None:
+                        logging.info(f"[{stage}] 请求超过 {hedge_delay:.1f} 秒未返回，已对冲至端点 {endpoint.name}")
+                    continue
+                for future in done:
+                    attempt = attempts.pop(future)
+                    endpoint = attempt.endpoint
+                    try:
+                        response, latency = future.result()
+                    except RETRYABLE_ERRORS as e:
+                        last_error = e
+                        self._record_failure(endpoint)
+                        logging.warning(f"[{stage}] 端点 {endpoint.name} 调用失败: {e}")
+                        if not attempts and len(tried) < self.max_attempts:
+                            # 指数退避后再切换，避免在限流或服务端错误时立即重试
+                            time.sleep(self.retry_backoff * 2 ** (len(tried) - 1))
+                            launch(tried)
+                        continue
+                    self._record_success(endpoint, stage, latency)
+                    if self.telemetry:
+                        self.telemetry.record(
+                            stage, model or endpoint.model, endpoint.name,
+                            time.monotonic() - start, response.usage, hedged, attempt_latency=latency,
+                        )
+                    return response
+        finally:
+            # 中止较慢的请求：未开始的直接取消，已发出的关闭其流式连接
+            for future, attempt in attempts.items():
+                future.cancel()
+                attempt.cancel()
+            with self._lock:
+                self._active.difference_update(launched)
+        raise last_error
@@ -1,14 +1,15 @@
 import os
 from pathlib import Path
-from deepseek_client import DeepSeekClient
+from deepseek_client import DeepSeekClient, section_concurrency
 from tqdm import tqdm
 import PyPDF2
 import re
-from openai import OpenAI
 from md_to_word import convert_md_to_word
 import logging
 import asyncio
+import argparse
 import concurrent.futures
+from planner import ExecutionPlanner
 
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -17,10 +18,6 @@ class BidGenerator:
     def __init__(self):
         self.client = DeepSeekClient()
         self.config = self.client.config
-        self.openai_client = OpenAI(
-            api_key=self.config["api"]["api_key"],
-            base_url=self.config["api"]["base_url"]
-        )
         
     async def read_tender_file(self, file_path):
         """读取招标文件内容"""
@@ -63,7 +60,7 @@ class BidGenerator:
             "招标文件内容：\n" + tender_content[:4000]
         )
         
-        requirements = await self._get_openai_response(requirements_prompt, "你是一个专业的标书结构分析专家，擅长提取招标文件中的编制要求。")
+        requirements = await self._get_openai_response(requirements_prompt, "你是一个专业的标书结构分析专家，擅长提取招标文件中的编制要求。", "extract_requirements")
         
         # 第二步：根据行业特点和招标内容补充必要章节
         industry_prompt = (
@@ -78,7 +75,7 @@ class BidGenerator:
             "请列出所有必要的章节，并说明每个章节的必要性。"
         )
         
-        industry_suggestions = await self._get_openai_response(industry_prompt, "你是一个专业的标书结构设计专家，擅长根据行业特点设计完整的标书结构。")
+        industry_suggestions = await self._get_openai_response(industry_prompt, "你是一个专业的标书结构设计专家，擅长根据行业特点设计完整的标书结构。", "extract_industry")
         
         # 第三步：整合和优化章节结构
         final_prompt = (
@@ -92,18 +89,18 @@ class BidGenerator:
             "4. 只返回最终的章节名称列表，每行一个章节名\n"
         )
         
-        final_response = await self._get_openai_response(final_prompt, "你是一个专业的标书结构优化专家，擅长整合和优化标书章节结构。")
+        final_response = await self._get_openai_response(final_prompt, "你是一个专业的标书结构优化专家，擅长整合和优化标书章节结构。", "extract_sections")
         
         raw = final_response
         # 解析章节名
         sections = [re.sub(r'^[0-9一二三四五六七八九十\.\、\s]+', '', line).strip() for line in raw.splitlines() if line.strip()]
         return [s for s in sections if s]
     
-    async def _get_openai_response(self, prompt, system_content):
+    async def _get_openai_response(self, prompt, system_content, stage="extract"):
         """获取OpenAI API的响应"""
         try:
-            response = self.openai_client.chat.completions.create(
-                model=self.config["api"]["model"],
+            response = self.client.pool.chat(
+                stage=stage,
                 messages=[
                     {"role": "system", "content": system_content},
                     {"role": "user", "content": prompt}
@@ -181,7 +178,7 @@ class BidGenerator:
         logging.info(f"自动识别到以下章节：{sections}")
         
         # 生成每个章节
-        with concurrent.futures.ThreadPoolExecutor() as executor:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=section_concurrency(self.config)) as executor:
             futures = [executor.submit(self.client.generate_bid_document, tender_content, section) for section in sections]
             retry_count = 0
             for future in tqdm(concurrent.futures.as_completed(futures), total=len(sections), desc=f"正在进行标书章节生成 - {tender_name}"):
@@ -216,7 +213,7 @@ class BidGenerator:
         
         logging.info(f"标书生成完成！输出目录：{self.config['paths']['output_dir']}/{tender_name}")
 
-async def main():
+async def main(args=None):
     generator = BidGenerator()
     
     # 获取输入目录中的所有招标文件
@@ -226,11 +223,33 @@ async def main():
     if not tender_files:
         logging.error(f"在 {input_dir} 目录下未找到招标文件！")
         return
+
+    # plan 模式：只估算调用次数、耗时和费用，不调用 API
+    if args is not None and args.mode == "plan":
+        planner = ExecutionPlanner(generator.config, quantile=args.quantile)
+        concurrency = args.concurrency or section_concurrency(generator.config)
+        planner.plan(tender_files, concurrency, sections=args.sections, rpm=args.rpm, tpm=args.tpm)
+        return
     
     # 处理每个招标文件
-    for tender_file in tender_files:
-        logging.info(f"\n处理招标文件：{tender_file.name}")
-        await generator.generate_bid_document(tender_file)
+    try:
+        for tender_file in tender_files:
+            logging.info(f"\n处理招标文件：{tender_file.name}")
+            await generator.generate_bid_document(tender_file)
+    finally:
+        # 中止仍在进行的请求，避免退出时等待
+        generator.client.pool.close()
+
+    # 输出分阶段调用统计
+    generator.client.telemetry.log_summary()
 
 if __name__ == "__main__":
-    asyncio.run(main()) 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="根据招标文件自动生成标书")
+    parser.add_argument("mode", nargs="?", choices=["generate", "plan"], default="generate",
+                        help="generate：生成标书；plan：仅估算调用次数、耗时和费用")
+    parser.add_argument("--concurrency", type=int, help="plan 模式下估算使用的章节并发数，默认取 generation.concurrency")
+    parser.add_argument("--sections", type=int, help="plan 模式下每份招标文件的章节数，默认根据历史记录估算")
+    parser.add_argument("--quantile", choices=["p50", "p90", "p99"], default="p50", help="plan 模式下使用的历史延迟分位数")
+    parser.add_argument("--rpm", type=int, help="每分钟请求数限制，用于建议并发数")
+    parser.add_argument("--tpm", type=int, help="每分钟 token 数限制，用于建议并发数")
+    asyncio.run(main(parser.parse_args())) 
\ No newline at end of file
@@ -0,0 +1,297 @@
+import heapq
+import logging
+from pathlib import Path
+from types import SimpleNamespace
+from endpoint_pool import endpoint_configs, stage_model_shares
+from telemetry import Telemetry
+
+# 单份招标文件的调用流程：章节目录提取的三步串行，之后每个章节独立执行 分析 -> 生成 -> 检查 -> (优化)
+EXTRACT_STAGES = ["extract_requirements", "extract_industry", "extract_sections"]
+SECTION_STAGES = ["analysis", "generation", "check", "optimization"]
+
+# 无历史记录时使用的粗略默认值：(延迟秒数, 输入 token, 输出 token)
+DEFAULT_STAGE_ESTIMATES = {
+    "extract_requirements": (15.0, 3000, 800),
+    "extract_industry": (20.0, 1000, 1000),
+    "extract_sections": (8.0, 2000, 300),
+    "analysis": (15.0, 3000, 800),
+    "generation": (60.0, 1000, 3000),
+    "check": (15.0, 3200, 600),
+    "optimization": (60.0, 3800, 3000),
+}
+DEFAULT_SECTIONS = 10
+
+
+class CallNode:
+    """调用图中的一次模型调用"""
+
+    def __init__(self, node_id, stage, deps, latency, prompt_tokens, completion_tokens, probability=1.0, chain=None):
+        self.node_id = node_id
+        self.stage = stage
+        self.deps = deps
+        # 所属章节；章节内的调用在同一个线程中串行执行，章节目录提取的调用为 None
+        self.chain = chain
+        self.latency = latency
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        # 条件执行的调用（如优化）按执行概率折算期望延迟和用量
+        self.probability = probability
+
+    @property
+    def expected_latency(self):
+        return self.latency * self.probability
+
+
+class ExecutionPlanner:
+    """
+    根据历史调用统计构建每份招标文件的调用图，估算给定并发下的耗时、token 用量和费用，
+    并给出并发数建议，无需实际调用 API。
+    """
+
+    def __init__(self, config, quantile="p50"):
+        self.config = config
+        self.quantile = quantile
+        self.history = Telemetry(config["paths"].get("telemetry_file")).load_history()
+        self.pricing = config.get("pricing") or {}
+        self.unpriced_models = set()
+        self.endpoints = [SimpleNamespace(**ep) for ep in endpoint_configs(config["api"])]
+        self._stage_stats = {}
+        self._hedge_rates = {}
+
+    def stage_models(self, stage):
+        """阶段路由后各模型承担的请求比例，与 EndpointPool 使用同一套路由规则"""
+        return stage_model_shares(self.endpoints, self.config.get("stages"), stage)
+
+    def stage_records(self, stage):
+        """阶段在当前路由模型下的历史调用记录"""
+        models = self.stage_models(stage)
+        return [r for r in self.history if r["stage"] == stage and r.get("model") in models]
+
+    def stage_stats(self, stage):
+        """阶段在当前路由模型下的历史统计，无记录时返回 None"""
+        if stage not in self._stage_stats:
+            self._stage_stats[stage] = Telemetry.summarize(self.stage_records(stage)).get(stage)
+        return self._stage_stats[stage]
+
+    def stage_estimate(self, stage):
+        """返回阶段的 (延迟, 输入 token, 输出 token)，优先使用同一模型的历史统计"""
+        default_latency, default_prompt, default_completion = DEFAULT_STAGE_ESTIMATES.get(stage, (15.0, 1000, 1000))
+        s = self.stage_stats(stage)
+        if not s:
+            return default_latency, default_prompt, default_completion
+        return (
+            s[self.quantile] or default_latency,
+            s["prompt_tokens"] if s["prompt_tokens"] is not None else default_prompt,
+            s["completion_tokens"] if s["completion_tokens"] is not None else default_completion,
+        )
+
+    def estimated_sections(self):
+        """按历史记录中每次章节提取对应的生成调用数估算章节数"""
+        extract = sum(1 for r in self.history if r["stage"] == "extract_sections")
+        generation = sum(1 for r in self.history if r["stage"] == "generation")
+        if not extract or not generation:
+            return DEFAULT_SECTIONS
+        return max(1, round(generation / extract))
+
+    def optimization_rate(self):
+        """质量检查后触发优化的比例，无历史时按全部触发估算"""
+        check = sum(1 for r in self.history if r["stage"] == "check")
+        optimization = sum(1 for r in self.history if r["stage"] == "optimization")
+        if not check:
+            return 1.0
+        return min(1.0, optimization / check)
+
+    def hedge_rate(self, stage):
+        """阶段调用中发生对冲的比例，用于估算额外的 token 消耗"""
+        if stage not in self._hedge_rates:
+            records = self.stage_records(stage)
+            hedged = sum(1 for r in records if r.get("hedged"))
+            self._hedge_rates[stage] = hedged / len(records) if records else 0.0
+        return self._hedge_rates[stage]
+
+    def build_graph(self, tender_name, sections):
+        """构建单份招标文件的调用图"""
+        nodes = []
+
+        def add(node_id, stage, deps, probability=1.0, chain=None):
+            latency, prompt_tokens, completion_tokens = self.stage_estimate(stage)
+            nodes.append(CallNode(node_id, stage, deps, latency, prompt_tokens, completion_tokens, probability, chain))
+            return node_id
+
+        previous = []
+        for stage in EXTRACT_STAGES:
+            previous = [add(f"{tender_name}/{stage}", stage, previous)]
+        extracted = previous
+        optimization_rate = self.optimization_rate()
+        for i in range(sections):
+            previous = extracted
+            for stage in SECTION_STAGES:
+                probability = optimization_rate if stage == "optimization" else 1.0
+                previous = [add(f"{tender_name}/section{i + 1}/{stage}", stage, previous, probability, i)]
+        return nodes
+
+    @staticmethod
+    def critical_path(nodes):
+        """返回关键路径上的节点及其期望耗时"""
+        by_id = {n.node_id: n for n in nodes}
+        finish = {}
+        parent = {}
+        for n in nodes:  # 节点按拓扑顺序添加
+            start = 0.0
+            for dep in n.deps:
+                if finish[dep] > start:
+                    start, parent[n.node_id] = finish[dep], dep
+            finish[n.node_id] = start + n.expected_latency
+        if not finish:
+            return [], 0.0
+        node_id = max(finish, key=finish.get)
+        total = finish[node_id]
+        path = [node_id]
+        while node_id in parent:
+            node_id = parent[node_id]
+            path.append(node_id)
+        return [by_id[i] for i in reversed(path)], total
+
+    @staticmethod
+    def simulate(nodes, concurrency):
+        """
+        按线程池的实际执行方式估算总耗时
+
+        章节目录提取串行执行；之后每个章节作为一个任务按提交顺序占用一个线程，
+        在同一线程内依次完成 分析 -> 生成 -> 检查 -> 优化，线程空闲后才开始下一个章节。
+        """
+        prefix = sum(n.expected_latency for n in nodes if n.chain is None)
+        chains = {}
+        for n in nodes:
+            if n.chain is not None:
+                chains[n.chain] = chains.get(n.chain, 0.0) + n.expected_latency
+        if not chains:
+            return prefix
+        workers = [prefix] * max(1, min(concurrency, len(chains)))
+        for duration in chains.values():
+            heapq.heappush(workers, heapq.heappop(workers) + duration)
+        return max(workers)
+
+    def usage(self, nodes):
+        """返回 (期望调用次数, 输入 token, 输出 token, 费用)"""
+        calls = prompt_tokens = completion_tokens = cost = 0.0
+        for n in nodes:
+            factor = n.probability * (1 + self.hedge_rate(n.stage))
+            calls += factor
+            prompt_tokens += n.prompt_tokens * factor
+            completion_tokens += n.completion_tokens * factor
+            for model, share in self.stage_models(n.stage).items():
+                price = self.pricing.get(model)
+                if price is None:
+                    self.unpriced_models.add(model)
+                    price = {}
+                cost += (n.prompt_tokens * price.get("input", 0) + n.completion_tokens * price.get("output", 0)) * factor * share / 1e6
+        return calls, prompt_tokens, completion_tokens, cost
+
+    def suggest_concurrency(self, nodes, max_concurrency, rpm=None, tpm=None, tolerance=0.1):
+        """
+        建议并发数：耗时不超过无限并发耗时 (1 + tolerance) 倍的最小并发，
+        同时满足每分钟请求数和 token 数限制
+
+        速率按章节生成阶段计算：串行的章节目录提取调用很少，计入会拉低实际峰值速率
+        """
+        _, best = self.critical_path(nodes)
+        prefix = self.simulate([n for n in nodes if n.chain is None], 1)
+        calls, prompt_tokens, completion_tokens, _ = self.usage([n for n in nodes if n.chain is not None])
+        suggestion = 1
+        suggested_wall = None
+        for concurrency in range(1, max_concurrency + 1):
+            wall = self.simulate(nodes, concurrency)
+            minutes = (wall - prefix) / 60
+            if minutes <= 0:
+                break
+            if (rpm and calls / minutes > rpm) or (tpm and (prompt_tokens + completion_tokens) / minutes > tpm):
+                break
+            # 耗时没有缩短时不提高并发，避免无谓地增加速率
+            if suggested_wall is None or wall < suggested_wall:
+                suggestion, suggested_wall = concurrency, wall
+            if wall <= best * (1 + tolerance):
+                break
+        return suggestion
+
+    def concurrency_limit(self):
+        """调用线程池可支撑的最大章节并发数：每个章节需为主请求和对冲请求各预留一个线程"""
+        max_workers = self.config["api"].get("max_workers")
+        return max(1, max_workers // 2) if max_workers else None
+
+    def plan(self, tender_files, concurrency, sections=None, rpm=None, tpm=None):
+        """
+        对一批招标文件生成执行计划并输出估算结果
+
+        Args:
+            tender_files (list): 招标文件路径
+            concurrency (int): 章节生成的并发上限
+            sections (int): 每份招标文件的章节数，为空时根据历史记录估算
+            rpm (int): 每分钟请求数限制
+            tpm (int): 每分钟 token 数限制
+
+        Returns:
+            dict: 汇总的调用次数、耗时、token 和费用估算
+        """
+        sections = sections or self.estimated_sections()
+        limit = self.concurrency_limit()
+        if limit and concurrency > limit:
+            logging.warning(f"并发 {concurrency} 超过 api.max_workers 可支撑的 {limit}，按 {limit} 估算")
+            concurrency = limit
+        output_dir = Path(self.config["paths"]["output_dir"])
+        logging.info(
+            f"执行计划：{len(tender_files)} 份招标文件，每份按 {sections} 个章节估算，并发上限 {concurrency}，"
+            f"历史记录 {len(self.history)} 条，延迟取 {self.quantile}"
+        )
+        for stage in EXTRACT_STAGES + SECTION_STAGES:
+            latency, prompt_tokens, completion_tokens = self.stage_estimate(stage)
+            source = "历史" if self.stage_stats(stage) else "默认"
+            logging.info(
+                f"  [{stage}] 模型 {', '.join(self.stage_models(stage))}，延迟 {latency:.1f}s，"
+                f"token 输入 {prompt_tokens:.0f} / 输出 {completion_tokens:.0f}（{source}）"
+            )
+
+        total = {"calls": 0.0, "wall_time": 0.0, "prompt_tokens": 0.0, "completion_tokens": 0.0, "cost": 0.0}
+        suggestions = []
+        for tender_file in tender_files:
+            tender_name = Path(tender_file).stem
+            if (output_dir / tender_name / f"{tender_name}_完整投标文件.md").exists():
+                logging.info(f"{tender_name}：已存在 Markdown 文件，仅执行 Word 转换，无模型调用")
+                continue
+            nodes = self.build_graph(tender_name, sections)
+            path, path_time = self.critical_path(nodes)
+            wall = self.simulate(nodes, concurrency)
+            calls, prompt_tokens, completion_tokens, cost = self.usage(nodes)
+            max_concurrency = max(concurrency, sections)
+            if limit:
+                max_concurrency = min(max_concurrency, limit)
+            suggestion = self.suggest_concurrency(nodes, max_concurrency, rpm, tpm)
+            suggestions.append(suggestion)
+            logging.info(
+                f"{tender_name}：约 {calls:.0f} 次调用，可并行阶段为各章节的 {' -> '.join(SECTION_STAGES)}，"
+                f"关键路径 {' -> '.join(n.stage for n in path)}（{path_time:.0f}s），"
+                f"并发 {concurrency} 时预计耗时 {wall:.0f}s，"
+                f"token 输入 {prompt_tokens:.0f} / 输出 {completion_tokens:.0f}，费用约 {cost:.2f}，建议并发 {suggestion}"
+            )
+            total["calls"] += calls
+            # 招标文件按顺序处理，总耗时为各文件耗时之和
+            total["wall_time"] += wall
+            total["prompt_tokens"] += prompt_tokens
+            total["completion_tokens"] += completion_tokens
+            total["cost"] += cost
+
+        total["suggested_concurrency"] = max(suggestions) if suggestions else concurrency
+        average_rpm = 0.0
+        if total["wall_time"]:
+            average_rpm = total["calls"] / (total["wall_time"] / 60)
+        total["cost_complete"] = not self.unpriced_models
+        for model in sorted(self.unpriced_models):
+            logging.warning(f"模型 {model} 未在 pricing 中配置价格，其费用按 0 计算")
+        logging.info(
+            f"合计：约 {total['calls']:.0f} 次调用，预计耗时 {total['wall_time'] / 60:.1f} 分钟，"
+            f"token 输入 {total['prompt_tokens']:.0f} / 输出 {total['completion_tokens']:.0f}，"
+            f"费用约 {total['cost']:.2f}{'' if total['cost_complete'] else '（不完整，未含未配置价格的模型）'}，平均 {average_rpm:.1f} 次/分钟，建议并发 {total['suggested_concurrency']}"
+        )
+        if total["suggested_concurrency"] != concurrency:
+            logging.info(f"可将 generation.concurrency 设置为 {total['suggested_concurrency']}")
+        return total
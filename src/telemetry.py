@@ -0,0 +1,99 @@
+import json
+import logging
+import math
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+
+
+def percentile(samples, q):
+    """按最近秩法计算分位数，q 取值范围 0~1"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))
+    return ordered[index]
+
+
+class Telemetry:
+    """按阶段记录模型调用的延迟和 token 用量，并追加写入 JSONL 文件供后续估算使用"""
+
+    def __init__(self, path=None):
+        self.path = Path(path) if path else None
+        self.records = []
+        self._lock = threading.Lock()
+
+    def record(self, stage, model, endpoint, latency, usage=None, hedged=False, attempt_latency=None):
+        """
+        记录一次调用
+
+        latency 为包含对冲等待和重试退避的端到端耗时，供执行计划估算；
+        attempt_latency 为胜出请求本身的耗时，供对冲延迟计算
+        """
+        entry = {
+            "time": time.time(),
+            "stage": stage,
+            "model": model,
+            "endpoint": endpoint,
+            "latency": round(latency, 3),
+            "attempt_latency": round(attempt_latency, 3) if attempt_latency is not None else None,
+            "prompt_tokens": getattr(usage, "prompt_tokens", None),
+            "completion_tokens": getattr(usage, "completion_tokens", None),
+            "hedged": hedged,
+        }
+        with self._lock:
+            self.records.append(entry)
+            if self.path:
+                try:
+                    self.path.parent.mkdir(parents=True, exist_ok=True)
+                    with open(self.path, 'a', encoding='utf-8') as f:
+                        f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                except Exception as e:
+                    logging.error(f"写入调用统计 {self.path} 时出错: {e}")
+
+    def load_history(self):
+        """读取历史调用记录"""
+        if not self.path or not self.path.exists():
+            return []
+        history = []
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    history.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+        return history
+
+    @staticmethod
+    def summarize(records):
+        """按阶段汇总调用次数、延迟分位数和平均 token 用量"""
+        by_stage = defaultdict(list)
+        for r in records:
+            by_stage[r["stage"]].append(r)
+        summary = {}
+        for stage, items in by_stage.items():
+            latencies = [r["latency"] for r in items]
+            prompt = [r["prompt_tokens"] for r in items if r.get("prompt_tokens") is not None]
+            completion = [r["completion_tokens"] for r in items if r.get("completion_tokens") is not None]
+            summary[stage] = {
+                "count": len(items),
+                "models": sorted({r["model"] for r in items}),
+                "p50": percentile(latencies, 0.5),
+                "p90": percentile(latencies, 0.9),
+                "p99": percentile(latencies, 0.99),
+                "prompt_tokens": sum(prompt) / len(prompt) if prompt else None,
+                "completion_tokens": sum(completion) / len(completion) if completion else None,
+            }
+        return summary
+
+    def log_summary(self):
+        """输出本次运行的分阶段统计"""
+        with self._lock:
+            records = list(self.records)
+        for stage, s in sorted(self.summarize(records).items()):
+            logging.info(
+                f"[{stage}] 模型 {','.join(s['models'])}，调用 {s['count']} 次，"
+                f"延迟 p50={s['p50']:.1f}s p90={s['p90']:.1f}s p99={s['p99']:.1f}s，"
+                f"平均 token 输入 {s['prompt_tokens'] or 0:.0f} / 输出 {s['completion_tokens'] or 0:.0f}"
+            )